@@ -2,6 +2,7 @@ const express = require('express');
 const { IncomingForm } = require('formidable');
 const path = require('path');
 const fs = require('fs');
+const os = require('os');
 const { PythonShell } = require('python-shell');
 const sharp = require('sharp');
 const { getWeatherBasedRecommendations } = require('../utils/weatherRecommendations');
@@ -14,6 +15,18 @@ const {
 
 const router = express.Router();
 
+// Segmentation scheduling: one Python process per core, a bounded wait queue
+// and a per-job deadline, so traffic spikes degrade or shed instead of thrashing
+const SEGMENTATION_WORKERS = Math.max(1, parseInt(process.env.SEGMENTATION_WORKERS, 10) || os.cpus().length);
+const SEGMENTATION_MAX_QUEUE = parseInt(process.env.SEGMENTATION_MAX_QUEUE, 10) || SEGMENTATION_WORKERS * 4;
+const SEGMENTATION_DEADLINE_MS = parseInt(process.env.SEGMENTATION_DEADLINE_MS, 10) || 30000;
+const SEGMENTATION_KILL_GRACE_MS = 2000;
+
+// Node's own per-request segmentation dumps only show at debug/info, like Python's
+const SEGMENTATION_VERBOSE = ['debug', 'info'].includes(
+  (process.env.SEGMENTATION_LOG_LEVEL || '').toLowerCase()
+);
+
 // Ensure directories exist
 const ensureDirectories = () => {
   const dirs = [
@@ -118,7 +131,17 @@ router.post('/', async (req, res) => {
         console.log(`[${sessionId}] Starting segmentation for category: ${uploaded_category}`);
         
         // Run segmentation
-        const segmentationResult = await runSegmentation(optimizedPath, outputDir);
+        const segmentationResult = await scheduleSegmentation(optimizedPath, outputDir);
+        
+        if (segmentationResult.shed) {
+          console.warn(`[${sessionId}] Segmentation shed: ${segmentationResult.error}`);
+          res.set('Retry-After', '5');
+          return res.status(503).json({
+            success: false,
+            message: 'Segmentation service is busy, please try again shortly',
+            error: segmentationResult.error
+          });
+        }
         
         if (!segmentationResult.success) {
           return res.status(500).json({
@@ -129,6 +152,9 @@ router.post('/', async (req, res) => {
         }
         
         console.log(`[${sessionId}] Segmentation completed successfully`);
+        if (segmentationResult.degradations?.length) {
+          console.warn(`[${sessionId}] Segmentation degraded: ${segmentationResult.degradations.join(', ')}`);
+        }
         
         // Get product recommendations based on analysis
         let productRecommendations = null;
@@ -219,7 +245,8 @@ router.post('/', async (req, res) => {
               mask_area: segmentationResult.mask_area,
               crop_size: segmentationResult.crop_size,
               bbox: segmentationResult.bbox,
-              method: segmentationResult.method
+              method: segmentationResult.method,
+              degradations: segmentationResult.degradations || []
             },
             color_analysis: segmentationResult.color_analysis || null
           },
@@ -273,11 +300,81 @@ router.post('/', async (req, res) => {
   }
 });
 
+let activeSegmentations = 0;
+const segmentationQueue = [];
+
+// Load-shedding counters; Node owns these because killed or rejected
+// Python processes never get to write their own metrics
+const segmentationShed = { queue_full: 0, deadline_queued: 0, deadline_expired: 0 };
+let segmentationKilled = 0;
+
+// Queue a segmentation job; resolves with { shed: true } when it cannot run in time
+const scheduleSegmentation = (inputPath, outputDir, deadlineMs = SEGMENTATION_DEADLINE_MS) => {
+  return new Promise((resolve) => {
+    if (segmentationQueue.length >= SEGMENTATION_MAX_QUEUE) {
+      segmentationShed.queue_full++;
+      resolve({ success: false, shed: true, error: 'Segmentation queue full' });
+      return;
+    }
+    
+    const job = { inputPath, outputDir, deadlineAt: Date.now() + deadlineMs, resolve };
+    
+    // Shed the job as soon as its deadline passes, not when a worker frees up
+    job.expiryTimer = setTimeout(() => {
+      const index = segmentationQueue.indexOf(job);
+      if (index !== -1) {
+        segmentationQueue.splice(index, 1);
+        segmentationShed.deadline_queued++;
+        resolve({ success: false, shed: true, error: 'Deadline exceeded while queued' });
+      }
+    }, deadlineMs);
+    
+    segmentationQueue.push(job);
+    drainSegmentationQueue();
+  });
+};
+
+// Start queued jobs while worker slots are free
+const drainSegmentationQueue = () => {
+  while (activeSegmentations < SEGMENTATION_WORKERS && segmentationQueue.length > 0) {
+    const job = segmentationQueue.shift();
+    clearTimeout(job.expiryTimer);
+    const timeLeft = job.deadlineAt - Date.now();
+    
+    if (timeLeft <= 0) {
+      segmentationShed.deadline_queued++;
+      job.resolve({ success: false, shed: true, error: 'Deadline exceeded while queued' });
+      continue;
+    }
+    
+    activeSegmentations++;
+    runSegmentation(job.inputPath, job.outputDir, {
+      deadlineAt: job.deadlineAt,
+      queueDepth: segmentationQueue.length
+    })
+      .then(job.resolve)
+      .catch((err) => {
+        console.error('❌ Failed to start segmentation:', err);
+        job.resolve({ success: false, error: err.message });
+      })
+      .finally(() => {
+        activeSegmentations--;
+        drainSegmentationQueue();
+      });
+  }
+};
+
 // Helper function to run Python segmentation
-const runSegmentation = (inputPath, outputDir) => {
+const runSegmentation = (inputPath, outputDir, { deadlineAt = Date.now() + SEGMENTATION_DEADLINE_MS, queueDepth = 0 } = {}) => {
   return new Promise((resolve, reject) => {
-    // Build arguments array
-    const args = ['--input', inputPath, '--output', outputDir];
+    // Build arguments array (deadline and queue depth let Python degrade quality to fit)
+    const args = [
+      '--input', inputPath,
+      '--output', outputDir,
+      '--deadline-at', String(deadlineAt),
+      '--queue-depth', String(queueDepth),
+      '--workers', String(SEGMENTATION_WORKERS)
+    ];
     
     const options = {
       mode: 'text',
@@ -287,22 +384,34 @@ const runSegmentation = (inputPath, outputDir) => {
       args: args
     };
     
-    console.log(`🐍 Running segmentation:`);
-    console.log(`   Command: python simple_segment.py ${args.join(' ')}`);
+    if (SEGMENTATION_VERBOSE) {
+      console.log(`🐍 Running segmentation:`);
+      console.log(`   Command: python simple_segment.py ${args.join(' ')}`);
+    }
     
     // Create Python shell with event handling for real-time logging
     const pythonShell = new PythonShell('simple_segment.py', options);
     
     let pythonOutput = '';
     let pythonErrors = '';
+    let timedOut = false;
+    
+    // Hard stop if Python overruns its deadline
+    const killAfterMs = Math.max(0, deadlineAt - Date.now()) + SEGMENTATION_KILL_GRACE_MS;
+    const killTimer = setTimeout(() => {
+      timedOut = true;
+      pythonShell.kill('SIGKILL');
+    }, killAfterMs);
     
     // Listen for stdout messages (JSON result)
     pythonShell.on('message', (message) => {
       pythonOutput += message + '\n';
-      console.log('📄 Python stdout:', message);
+      if (SEGMENTATION_VERBOSE) {
+        console.log('📄 Python stdout:', message);
+      }
     });
     
-    // Listen for stderr messages (color extraction logs)
+    // Listen for stderr messages (already filtered by Python's log level, so always relayed)
     pythonShell.on('stderr', (stderr) => {
       pythonErrors += stderr + '\n';
       console.log('🎨 Python stderr:', stderr);
@@ -310,6 +419,19 @@ const runSegmentation = (inputPath, outputDir) => {
     
     // Handle completion
     pythonShell.end((err, code, signal) => {
+      clearTimeout(killTimer);
+      
+      if (timedOut) {
+        segmentationKilled++;
+        console.error(`❌ Python segmentation killed after ${killAfterMs}ms`);
+        resolve({
+          success: false,
+          shed: true,
+          error: 'Segmentation timed out'
+        });
+        return;
+      }
+      
       if (err) {
         console.error('❌ Python segmentation error:', err);
         console.error('Python stderr output:', pythonErrors);
@@ -334,12 +456,19 @@ const runSegmentation = (inputPath, outputDir) => {
         // Parse the JSON result from stdout
         const lines = pythonOutput.trim().split('\n');
         const jsonOutput = lines[lines.length - 1];
-        console.log('✅ Python JSON result:', jsonOutput);
-        
         const result = JSON.parse(jsonOutput);
         
+        // Python sheds jobs whose deadline passed before it could start
+        if (result.shed) {
+          segmentationShed.deadline_expired++;
+        }
+        
+        if (SEGMENTATION_VERBOSE) {
+          console.log('✅ Python JSON result:', jsonOutput);
+        }
+        
         // Log color results if available
-        if (result.color_analysis) {
+        if (SEGMENTATION_VERBOSE && result.color_analysis) {
           console.log('🎨 ==================== COLOR ANALYSIS RESULTS ====================');
           console.log(`🔥 Dominant Color: ${result.color_analysis.dominant_color.hex} (RGB: ${result.color_analysis.dominant_color.rgb})`);
           
@@ -374,7 +503,45 @@ const runSegmentation = (inputPath, outputDir) => {
   });
 };
 
+// Prometheus metrics: the textfile Python accumulates plus the queue state Node owns
+const segmentationMetrics = async (req, res) => {
+  const metricsFile = process.env.SEGMENTATION_METRICS_FILE;
+  let body = '';
+  
+  if (metricsFile) {
+    try {
+      body = await fs.promises.readFile(metricsFile, 'utf8');
+    } catch (error) {
+      // No segmentation has finished yet
+      if (error.code !== 'ENOENT') {
+        console.error('⚠️ Failed to read segmentation metrics:', error.message);
+      }
+    }
+  }
+  
+  body += [
+    '# HELP segmentation_queue_depth Segmentation jobs waiting for a worker',
+    '# TYPE segmentation_queue_depth gauge',
+    `segmentation_queue_depth ${segmentationQueue.length}`,
+    '# HELP segmentation_active_workers Segmentation processes currently running',
+    '# TYPE segmentation_active_workers gauge',
+    `segmentation_active_workers ${activeSegmentations}`,
+    '# HELP segmentation_shed_total Requests rejected without running segmentation, by reason',
+    '# TYPE segmentation_shed_total counter',
+    ...Object.entries(segmentationShed).map(
+      ([reason, count]) => `segmentation_shed_total{reason="${reason}"} ${count}`
+    ),
+    '# HELP segmentation_killed_total Segmentation processes killed for overrunning their deadline',
+    '# TYPE segmentation_killed_total counter',
+    `segmentation_killed_total ${segmentationKilled}`,
+    ''
+  ].join('\n');
+  
+  res.type('text/plain; version=0.0.4').send(body);
+};
+
 // Serve segmentation output files
 router.use('/outputs', express.static(path.join(__dirname, '..', 'segmentation', 'outputs')));
 
-module.exports = router;
\ No newline at end of file
+module.exports = router;
+module.exports.segmentationMetrics = segmentationMetrics;
\ No newline at end of file
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Lightweight Prometheus-format metrics for the segmentation workers
+Stdlib only, so it works wherever simple_segment.py works
+"""
+
+import os
+import copy
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows - textfile merges are not locked
+    fcntl = None
+
+# Latency buckets (seconds) cover fast GrabCut runs up to slow CPU U²-Net inference
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Image size buckets (pixels), roughly 256² up to the 1024² the backend resizes to
+PIXEL_BUCKETS = (65536, 262144, 524288, 786432, 1048576, 2097152, 4194304)
+
+_lock = threading.Lock()
+
+
+def _label_key(labelnames, labels):
+    """Build a hashable key from label values in declaration order"""
+    missing = set(labelnames) - set(labels)
+    if missing:
+        raise ValueError(f"Missing labels: {', '.join(sorted(missing))}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    """Render a label set as {a="1",b="2"}"""
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    """Render a sample value the way Prometheus expects"""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing counter"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def dump(self):
+        return {'|'.join(key): value for key, value in self.values.items()}
+
+    def merge(self, state):
+        for joined, value in state.items():
+            key = tuple(joined.split('|')) if self.labelnames else ()
+            self.values[key] = self.values.get(key, 0) + value
+
+    def reset(self):
+        self.values = {}
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            entry = self.values.setdefault(
+                key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of a with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, entry in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, entry['buckets']):
+                le = ('le', _format_value(bound))
+                yield self.name + '_bucket', _format_labels(self.labelnames, key, le), count
+            yield self.name + '_sum', _format_labels(self.labelnames, key), entry['sum']
+            yield self.name + '_count', _format_labels(self.labelnames, key), entry['count']
+
+    def dump(self):
+        return {'|'.join(key): entry for key, entry in self.values.items()}
+
+    def merge(self, state):
+        for joined, other in state.items():
+            key = tuple(joined.split('|')) if self.labelnames else ()
+            entry = self.values.setdefault(
+                key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            )
+            entry['buckets'] = [a + b for a, b in zip(entry['buckets'], other['buckets'])]
+            entry['sum'] += other['sum']
+            entry['count'] += other['count']
+
+    def reset(self):
+        self.values = {}
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with _lock:
+            for metric in self.metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.documentation}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self):
+        with _lock:
+            return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def merge(self, state):
+        with _lock:
+            for name, metric_state in state.items():
+                if name in self.metrics:
+                    self.metrics[name].merge(metric_state)
+
+    def drain(self):
+        """Dump and reset in one step so no update falls in between"""
+        with _lock:
+            state = {name: metric.dump() for name, metric in self.metrics.items()}
+            for metric in self.metrics.values():
+                metric.reset()
+        return state
+
+    def empty_copy(self):
+        """Same metric definitions with no recorded values"""
+        registry = Registry()
+        for metric in self.metrics.values():
+            clone = copy.copy(metric)
+            clone.values = {}
+            registry.register(clone)
+        return registry
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'segmentation_requests_total',
+    'Segmentation requests received'))
+ENGINE = REGISTRY.register(Counter(
+    'segmentation_engine_total',
+    'Segmentation requests served, by engine that produced the result',
+    ['engine']))
+FALLBACKS = REGISTRY.register(Counter(
+    'segmentation_fallbacks_total',
+    'Falls back from U²-Net to simple segmentation, by reason',
+    ['reason']))
+FAILURES = REGISTRY.register(Counter(
+    'segmentation_failures_total',
+    'Segmentation attempts that returned an error, by engine',
+    ['engine']))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'segmentation_stage_seconds',
+    'Wall-clock time spent in each segmentation stage',
+    ['stage']))
+IMAGE_PIXELS = REGISTRY.register(Histogram(
+    'segmentation_image_pixels',
+    'Input image size in pixels',
+    buckets=PIXEL_BUCKETS))
+DEGRADATIONS = REGISTRY.register(Counter(
+    'segmentation_degradations_total',
+    'Quality reductions applied to meet load or deadline targets, by kind',
+    ['kind']))
+
+
+def _state_path(path):
+    return path + '.state.json'
+
+
+def write_textfile(path, registry=REGISTRY):
+    """Merge this process's metrics into a Prometheus textfile
+
+    Every CLI run is a separate process, so the running totals live in a
+    JSON sidecar next to the .prom file. Only counters and histograms are
+    kept, since those add up safely across processes; call this once, as
+    the process exits. Queue depth is exported by the Node server.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    with open(path + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            local_state = registry.drain()
+
+            # Load previous totals and fold in this process's deltas
+            totals = registry.empty_copy()
+            state_path = _state_path(path)
+            if os.path.exists(state_path):
+                try:
+                    with open(state_path) as f:
+                        totals.merge(json.load(f))
+                except (OSError, ValueError):
+                    pass  # Corrupt sidecar - start counting again
+            totals.merge(local_state)
+
+            tmp_state = state_path + '.tmp'
+            with open(tmp_state, 'w') as f:
+                json.dump(totals.dump(), f)
+            os.replace(tmp_state, state_path)
+
+            tmp_prom = path + '.tmp'
+            with open(tmp_prom, 'w') as f:
+                f.write(totals.render())
+            os.replace(tmp_prom, path)
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -6,15 +6,55 @@ Fallback when U²-Net dependencies are not available
 
 import sys
 import os
+import time
 import cv2
 import numpy as np
 import json
+import logging
+import importlib.util
 import argparse
 from PIL import Image
 from colorthief import ColorThief
+from metrics import (
+    REQUESTS, ENGINE, FALLBACKS, FAILURES, STAGE_LATENCY, IMAGE_PIXELS,
+    DEGRADATIONS,
+    write_textfile
+)
 import warnings
 warnings.filterwarnings("ignore")
 
+logger = logging.getLogger('segmentation')
+
+# Rough CPU cost (seconds) of each pipeline option on a 1024px image, used to
+# decide what still fits in a job's deadline
+U2NET_SECONDS = 8.0
+TORCH_IMPORT_SECONDS = 3.0  # u2net_segment is imported lazily, per process
+GRABCUT_SECONDS_PER_ITERATION = 0.4
+PALETTE_SECONDS = 0.5
+
+# Optional packages U²-Net needs (see requirements.txt)
+U2NET_MODULES = ('torch', 'torchvision', 'skimage')
+
+DEFAULT_GRABCUT_ITERATIONS = 5
+REDUCED_GRABCUT_ITERATIONS = 2
+
+# Degradation ladder, cheapest-to-lose first: (engine, grabcut iterations, palette)
+DEGRADATION_LEVELS = [
+    ('auto', DEFAULT_GRABCUT_ITERATIONS, True),
+    ('simple', DEFAULT_GRABCUT_ITERATIONS, True),
+    ('simple', REDUCED_GRABCUT_ITERATIONS, True),
+    ('simple', REDUCED_GRABCUT_ITERATIONS, False),
+    ('simple', 1, False),
+]
+
+def configure_logging(level):
+    """Send leveled logs to stderr (quiet by default, stdout stays JSON only)"""
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=getattr(logging, level.upper(), logging.WARNING),
+        format='%(message)s'
+    )
+
 def rgb_to_hex(rgb):
     """Convert RGB tuple to hex string"""
     return "#{:02x}{:02x}{:02x}".format(int(rgb[0]), int(rgb[1]), int(rgb[2]))
@@ -124,42 +164,42 @@ def extract_color_palette(image_path, mask_path):
         masked_pil.save(masked_path)
         
         # Use ColorThief on the transparent masked image
-        print(f"🔍 Analyzing colors from: {masked_path}", file=sys.stderr)
+        logger.debug("🔍 Analyzing colors from: %s", masked_path)
         color_thief = ColorThief(masked_path)
         
         # Get dominant color
         dominant_color = color_thief.get_color(quality=1)
-        print(f"📊 ColorThief dominant color: RGB{dominant_color}", file=sys.stderr)
+        logger.debug("📊 ColorThief dominant color: RGB%s", dominant_color)
         
         # Get color palette (top 5 colors)
         try:
             palette = color_thief.get_palette(color_count=5, quality=1)
-            print(f"🎨 ColorThief palette extracted: {len(palette)} colors", file=sys.stderr)
+            logger.debug("🎨 ColorThief palette extracted: %d colors", len(palette))
             for i, color in enumerate(palette, 1):
-                print(f"     Color {i}: RGB{color}", file=sys.stderr)
+                logger.debug("     Color %d: RGB%s", i, color)
         except Exception as e:
             # Fallback if palette extraction fails
-            print(f"⚠️  Palette extraction failed: {e}, using dominant color only", file=sys.stderr)
+            logger.warning("⚠️  Palette extraction failed: %s, using dominant color only", e)
             palette = [dominant_color]
         
         # Generate color variations
         dominant_rgb = dominant_color
-        print(f"🧮 Calculating color variations from RGB{dominant_rgb}:", file=sys.stderr)
+        logger.debug("🧮 Calculating color variations from RGB%s:", dominant_rgb)
         
         # 1 & 2. Create extreme lighter and darker variations using HSL
         lighter_rgb, darker_rgb = create_extreme_variations(dominant_rgb)
-        print(f"     ☀️  Extreme lighter shade: RGB{lighter_rgb}", file=sys.stderr)
-        print(f"     🌙 Extreme darker shade: RGB{darker_rgb}", file=sys.stderr)
+        logger.debug("     ☀️  Extreme lighter shade: RGB%s", lighter_rgb)
+        logger.debug("     🌙 Extreme darker shade: RGB%s", darker_rgb)
         
         # 3. Complementary color
         complementary_rgb = get_complementary_color(dominant_rgb)
-        print(f"     🔄 Complementary color: RGB{complementary_rgb}", file=sys.stderr)
+        logger.debug("     🔄 Complementary color: RGB%s", complementary_rgb)
         
         # 4. Standard colors
         black_rgb = (0, 0, 0)
         white_rgb = (255, 255, 255)
-        print(f"     ⚫ Neutral black: RGB{black_rgb}", file=sys.stderr)
-        print(f"     ⚪ Neutral white: RGB{white_rgb}", file=sys.stderr)
+        logger.debug("     ⚫ Neutral black: RGB%s", black_rgb)
+        logger.debug("     ⚪ Neutral white: RGB%s", white_rgb)
         
         # Convert all to hex
         color_analysis = {
@@ -201,14 +241,16 @@ def extract_color_palette(image_path, mask_path):
         return color_analysis
         
     except Exception as e:
-        print(f"Color extraction error: {e}", file=sys.stderr)
+        logger.warning("Color extraction error: %s", e)
         return None
 
-def simple_segmentation(image_path, output_dir):
+def simple_segmentation(image_path, output_dir, grabcut_iterations=DEFAULT_GRABCUT_ITERATIONS,
+                        extract_palette=True):
     """Simple segmentation using background subtraction and edge detection"""
     try:
         # Read image
-        image = cv2.imread(image_path)
+        with STAGE_LATENCY.time(stage='read'):
+            image = cv2.imread(image_path)
         if image is None:
             return {'success': False, 'error': 'Could not read image'}
         
@@ -235,7 +277,9 @@ def simple_segmentation(image_path, output_dir):
         bgd_model = np.zeros((1, 65), np.float64)
         fgd_model = np.zeros((1, 65), np.float64)
         
-        cv2.grabCut(image, mask, rect, bgd_model, fgd_model, 5, cv2.GC_INIT_WITH_RECT)
+        with STAGE_LATENCY.time(stage='grabcut'):
+            cv2.grabCut(image, mask, rect, bgd_model, fgd_model, grabcut_iterations,
+                        cv2.GC_INIT_WITH_RECT)
         
         # Create binary mask
         mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
@@ -298,19 +342,23 @@ def simple_segmentation(image_path, output_dir):
         }
         
         # Save outputs
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Save mask
-        mask_path = os.path.join(output_dir, 'garment_mask.png')
-        cv2.imwrite(mask_path, final_mask * 255)
-        
-        # Save crop
-        crop_path = os.path.join(output_dir, 'garment_crop.jpg')
-        cv2.imwrite(crop_path, crop)
+        with STAGE_LATENCY.time(stage='save'):
+            os.makedirs(output_dir, exist_ok=True)
+            
+            # Save mask
+            mask_path = os.path.join(output_dir, 'garment_mask.png')
+            cv2.imwrite(mask_path, final_mask * 255)
+            
+            # Save crop
+            crop_path = os.path.join(output_dir, 'garment_crop.jpg')
+            cv2.imwrite(crop_path, crop)
         
         # Extract colors from the masked region
-        print("🎨 Starting color extraction...", file=sys.stderr)
-        color_analysis = extract_color_palette(image_path, mask_path)
+        color_analysis = None
+        if extract_palette:
+            logger.debug("🎨 Starting color extraction...")
+            with STAGE_LATENCY.time(stage='color_extraction'):
+                color_analysis = extract_color_palette(image_path, mask_path)
         
         result = {
             'success': True,
@@ -329,35 +377,36 @@ def simple_segmentation(image_path, output_dir):
         if color_analysis:
             result['color_analysis'] = color_analysis
             
-            # Print detailed color information
-            print("=" * 60, file=sys.stderr)
-            print("🎨 COLOR EXTRACTION RESULTS", file=sys.stderr)
-            print("=" * 60, file=sys.stderr)
-            
-            # Print dominant color
-            dom_color = color_analysis['dominant_color']
-            print(f"🔥 DOMINANT COLOR:", file=sys.stderr)
-            print(f"   RGB: {dom_color['rgb']}", file=sys.stderr)
-            print(f"   HEX: {dom_color['hex']}", file=sys.stderr)
-            print("", file=sys.stderr)
-            
-            # Print full color palette
-            print(f"🎭 FULL COLOR PALETTE ({len(color_analysis['palette'])} colors):", file=sys.stderr)
-            for i, color in enumerate(color_analysis['palette'], 1):
-                print(f"   {i}. RGB{color['rgb']} → {color['hex']}", file=sys.stderr)
-            print("", file=sys.stderr)
+            # Log detailed color information (skipped entirely unless verbose)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("=" * 60)
+                logger.info("🎨 COLOR EXTRACTION RESULTS")
+                logger.info("=" * 60)
+                
+                # Dominant color
+                dom_color = color_analysis['dominant_color']
+                logger.info("🔥 DOMINANT COLOR:")
+                logger.info("   RGB: %s", dom_color['rgb'])
+                logger.info("   HEX: %s", dom_color['hex'])
+                logger.info("")
+                
+                # Full color palette
+                logger.info("🎭 FULL COLOR PALETTE (%d colors):", len(color_analysis['palette']))
+                for i, color in enumerate(color_analysis['palette'], 1):
+                    logger.info("   %d. RGB%s → %s", i, color['rgb'], color['hex'])
+                logger.info("")
+                
+                # Recommended color variations
+                logger.info("✨ RECOMMENDED COLOR VARIATIONS:")
+                rec_colors = color_analysis['recommended_colors']
+                for color_type, color_info in rec_colors.items():
+                    color_name = color_type.replace('_', ' ').title()
+                    logger.info("   %s: RGB%s → %s", color_name, color_info['rgb'], color_info['hex'])
+                
+                logger.info("=" * 60)
             
-            # Print recommended color variations
-            print("✨ RECOMMENDED COLOR VARIATIONS:", file=sys.stderr)
-            rec_colors = color_analysis['recommended_colors']
-            for color_type, color_info in rec_colors.items():
-                color_name = color_type.replace('_', ' ').title()
-                print(f"   {color_name}: RGB{color_info['rgb']} → {color_info['hex']}", file=sys.stderr)
-            
-            print("=" * 60, file=sys.stderr)
-            
-        else:
-            print("❌ Color analysis failed", file=sys.stderr)
+        elif extract_palette:
+            logger.warning("❌ Color analysis failed")
         
         return result
         
@@ -367,34 +416,149 @@ def simple_segmentation(image_path, output_dir):
             'error': str(e)
         }
 
+def u2net_available():
+    """Check U²-Net's optional dependencies are installed without importing torch"""
+    return all(importlib.util.find_spec(name) is not None for name in U2NET_MODULES)
+
+def plan_degradation(queue_depth=0, workers=1, time_left=None):
+    """Pick pipeline options that fit the current load and deadline
+    
+    Each job waiting per worker steps one level down DEGRADATION_LEVELS;
+    a deadline steps down further until the estimated cost fits.
+    """
+    has_u2net = u2net_available()
+    level = min(int(queue_depth / max(workers, 1)), len(DEGRADATION_LEVELS) - 1)
+    
+    if time_left is not None:
+        while level < len(DEGRADATION_LEVELS) - 1:
+            engine, iterations, palette = DEGRADATION_LEVELS[level]
+            cost = iterations * GRABCUT_SECONDS_PER_ITERATION
+            if palette:
+                cost += PALETTE_SECONDS
+            if engine == 'auto' and has_u2net:
+                cost = max(cost, TORCH_IMPORT_SECONDS + U2NET_SECONDS)
+            if cost <= time_left:
+                break
+            level += 1
+    
+    engine, iterations, palette = DEGRADATION_LEVELS[level]
+    degradations = []
+    if engine != 'auto' and has_u2net:
+        degradations.append('u2net_skipped')
+    if iterations < DEFAULT_GRABCUT_ITERATIONS:
+        degradations.append('grabcut_iterations_reduced')
+    if not palette:
+        degradations.append('palette_skipped')
+    
+    return {
+        'engine': engine,
+        'grabcut_iterations': iterations,
+        'extract_palette': palette,
+        'degradations': degradations
+    }
+
+def run_segmentation(image_path, output_dir, plan=None):
+    """Try U²-Net first, fall back to simple segmentation, recording metrics"""
+    if plan is None:
+        plan = plan_degradation()
+    simple_options = {
+        'grabcut_iterations': plan['grabcut_iterations'],
+        'extract_palette': plan['extract_palette']
+    }
+    
+    if plan['engine'] != 'auto':
+        result = simple_segmentation(image_path, output_dir, **simple_options)
+    else:
+        try:
+            from u2net_segment import segment_garment
+        except Exception as e:
+            # Missing or broken optional deps (e.g. mismatched torch/numpy)
+            if not isinstance(e, ImportError):
+                logger.warning("U²-Net unavailable: %s, falling back to simple segmentation", e)
+            FALLBACKS.inc(reason='u2net_unavailable')
+            result = simple_segmentation(image_path, output_dir, **simple_options)
+        else:
+            try:
+                result = segment_garment(image_path, output_dir)
+            except Exception as e:
+                logger.warning("U²-Net failed: %s, falling back to simple segmentation", e)
+                result = {'success': False, 'error': str(e)}
+            
+            if result['success']:
+                result['method'] = 'u2net'
+            else:
+                FAILURES.inc(engine='u2net')
+                FALLBACKS.inc(reason='u2net_failed')
+                result = simple_segmentation(image_path, output_dir, **simple_options)
+    
+    engine = result.get('method', 'simple_segmentation')
+    if result['success']:
+        ENGINE.inc(engine=engine)
+    else:
+        FAILURES.inc(engine=engine)
+    
+    result['degradations'] = plan['degradations']
+    for kind in plan['degradations']:
+        DEGRADATIONS.inc(kind=kind)
+    if plan['degradations']:
+        logger.info("Degraded segmentation: %s", ', '.join(plan['degradations']))
+    return result
+
 def main():
     parser = argparse.ArgumentParser(description='Simple Garment Segmentation with Weather Analysis')
     parser.add_argument('--input', required=True, help='Input image path')
     parser.add_argument('--output', required=True, help='Output directory')
     parser.add_argument('--temperature', type=float, help='Temperature in Celsius for material recommendations')
     parser.add_argument('--category', help='Garment category (top, bottom, footwear, accessory)')
+    parser.add_argument('--log-level', default=os.environ.get('SEGMENTATION_LOG_LEVEL', 'warning'),
+                        choices=['debug', 'info', 'warning', 'error'],
+                        help='stderr log level (default: warning)')
+    parser.add_argument('--metrics-file', default=os.environ.get('SEGMENTATION_METRICS_FILE'),
+                        help='Accumulate Prometheus metrics into this textfile')
+    parser.add_argument('--deadline-at', type=float,
+                        help='Absolute job deadline in epoch milliseconds; quality is reduced to fit it')
+    parser.add_argument('--queue-depth', type=int, default=0,
+                        help='Jobs waiting behind this one, as seen by the caller')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Concurrent segmentation workers (default: CPU count)')
     
     args = parser.parse_args()
+    configure_logging(args.log_level)
     
-    # Send debug message to stderr, not stdout
-    print("Pre-trained model not found, using random weights (demo mode)", file=sys.stderr)
+    REQUESTS.inc()
     
-    # Try U²-Net first, fall back to simple method
     try:
-        from u2net_segment import segment_garment
-        result = segment_garment(args.input, args.output)
-        if result['success']:
-            result['method'] = 'u2net'
+        try:
+            with Image.open(args.input) as img:
+                IMAGE_PIXELS.observe(img.size[0] * img.size[1])
+        except Exception:
+            pass  # Unreadable input is reported by the segmentation itself
+        
+        time_left = None
+        if args.deadline_at is not None:
+            # Wall clock, so spawn and import time already count against the budget
+            time_left = args.deadline_at / 1000.0 - time.time()
+        
+        if time_left is not None and time_left <= 0:
+            result = {
+                'success': False,
+                'error': 'Deadline exceeded before segmentation started',
+                'shed': True,
+                'degradations': []
+            }
         else:
-            result = simple_segmentation(args.input, args.output)
-    except ImportError:
-        result = simple_segmentation(args.input, args.output)
-    except Exception as e:
-        print(f"U²-Net failed: {e}, falling back to simple segmentation", file=sys.stderr)
-        result = simple_segmentation(args.input, args.output)
+            plan = plan_degradation(args.queue_depth, args.workers, time_left)
+            with STAGE_LATENCY.time(stage='total'):
+                result = run_segmentation(args.input, args.output, plan)
+    finally:
+        if args.metrics_file:
+            try:
+                write_textfile(args.metrics_file)
+            except OSError as e:
+                logger.warning("Could not write metrics to %s: %s", args.metrics_file, e)
     
     # Output only JSON to stdout
     print(json.dumps(result))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
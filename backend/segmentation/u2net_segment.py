@@ -9,6 +9,7 @@ import os
 import cv2
 import numpy as np
 import json
+import logging
 import argparse
 from PIL import Image
 import torch
@@ -16,9 +17,12 @@ import torch.nn.functional as F
 from torchvision import transforms
 import urllib.request
 from skimage import morphology
+from metrics import STAGE_LATENCY
 import warnings
 warnings.filterwarnings("ignore")
 
+logger = logging.getLogger('segmentation.u2net')
+
 # Simple U²-Net architecture (lightweight version)
 class RSU7(torch.nn.Module):
     def __init__(self, in_ch=3, mid_ch=12, out_ch=3):
@@ -142,7 +146,7 @@ def load_model():
     # Try to download pre-trained weights (simplified for demo)
     model_path = "u2net.pth"
     if not os.path.exists(model_path):
-        print("Pre-trained model not found, using random weights (demo mode)")
+        logger.info("Pre-trained model not found, using random weights (demo mode)")
         # In production, you would download actual U²-Net weights
         # torch.save(model.state_dict(), model_path)
     
@@ -221,18 +225,21 @@ def segment_garment(image_path, output_dir):
     """Main segmentation function"""
     try:
         # Load model
-        model = load_model()
+        with STAGE_LATENCY.time(stage='model_load'):
+            model = load_model()
         
         # Preprocess
-        image_tensor, original_size, original_image = preprocess_image(image_path)
+        with STAGE_LATENCY.time(stage='preprocess'):
+            image_tensor, original_size, original_image = preprocess_image(image_path)
         
         # Run inference
-        with torch.no_grad():
+        with STAGE_LATENCY.time(stage='inference'), torch.no_grad():
             prediction = model(image_tensor)
             mask = prediction.squeeze().cpu().numpy()
         
         # Postprocess
-        mask_clean = postprocess_mask(mask, original_size)
+        with STAGE_LATENCY.time(stage='postprocess'):
+            mask_clean = postprocess_mask(mask, original_size)
         
         # Convert original image to numpy
         image_np = np.array(original_image)
@@ -247,20 +254,21 @@ def segment_garment(image_path, output_dir):
             }
         
         # Save outputs
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Save mask
-        mask_path = os.path.join(output_dir, 'garment_mask.png')
-        cv2.imwrite(mask_path, mask_clean * 255)
-        
-        # Save crop
-        crop_path = os.path.join(output_dir, 'garment_crop.jpg')
-        cv2.imwrite(crop_path, cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
-        
-        # Save mask crop for reference
-        mask_crop_path = os.path.join(output_dir, 'mask_crop.png')
-        mask_crop = mask_clean[bbox['y_min']:bbox['y_max'], bbox['x_min']:bbox['x_max']]
-        cv2.imwrite(mask_crop_path, mask_crop * 255)
+        with STAGE_LATENCY.time(stage='save'):
+            os.makedirs(output_dir, exist_ok=True)
+            
+            # Save mask
+            mask_path = os.path.join(output_dir, 'garment_mask.png')
+            cv2.imwrite(mask_path, mask_clean * 255)
+            
+            # Save crop
+            crop_path = os.path.join(output_dir, 'garment_crop.jpg')
+            cv2.imwrite(crop_path, cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
+            
+            # Save mask crop for reference
+            mask_crop_path = os.path.join(output_dir, 'mask_crop.png')
+            mask_crop = mask_clean[bbox['y_min']:bbox['y_max'], bbox['x_min']:bbox['x_max']]
+            cv2.imwrite(mask_crop_path, mask_crop * 255)
         
         return {
             'success': True,
@@ -54,3 +54,13 @@ const PORT = process.env.PORT || 4000;
 app.listen(PORT, () =>
   console.log(`Backend running on http://localhost:${PORT}`)
 );
+
+// Segmentation metrics for Prometheus, on a separate localhost-only port
+const METRICS_PORT = process.env.SEGMENTATION_METRICS_PORT;
+if (METRICS_PORT) {
+  const metricsApp = express();
+  metricsApp.get("/metrics", completeMyLookRoutes.segmentationMetrics);
+  metricsApp.listen(METRICS_PORT, "127.0.0.1", () =>
+    console.log(`Segmentation metrics on http://127.0.0.1:${METRICS_PORT}/metrics`)
+  );
+}